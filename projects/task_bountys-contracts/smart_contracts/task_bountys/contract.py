@@ -1,23 +1,71 @@
-from algopy import UInt64, gtxn, ARC4Contract, arc4, Global, itxn, BoxMap
+from algopy import (
+    UInt64,
+    Bytes,
+    Account,
+    gtxn,
+    ARC4Contract,
+    arc4,
+    Global,
+    itxn,
+    BoxMap,
+    TransactionType,
+    op,
+    subroutine,
+)
+
+MAX_VOTERS = 256
+# Largest inner transaction group the AVM will submit at once
+MAX_INNER_GROUP = 16
+# Voters share 1/VOTER_POOL_DIVISOR of the disputed reward
+VOTER_POOL_DIVISOR = 10
+# MBR of one voted box: "voted" prefix + task_id + voter key, 1-byte arc4.Bool value
+VOTE_BOX_MBR = 2_500 + 400 * (5 + 8 + 32 + 1)
+
+# TaskState.flags bits. DISPUTE_OPEN with either *_PAID bit means the
+# dispute is settling: a tie half has been paid, so the tallies are frozen
+# and only the other half can be taken. Exactly BOTH_PAID means settled.
+DISPUTE_OPEN = 1
+CLIENT_PAID = 2
+FREELANCER_PAID = 4
+BOTH_PAID = CLIENT_PAID | FREELANCER_PAID
+
+# Assert messages used at more than one site
+ERR_COMPANY_ONLY = "Only company can call this"
+ERR_NOT_PARTY = "Caller is not a party to the task"
+ERR_SETTLING = "Dispute is settling"
+ERR_NOT_SETTLED = "Dispute not settled"
+ERR_NO_DISPUTE = "No dispute active"
+ERR_DISPUTED = "Task is in dispute"
 
 class TaskData(arc4.Struct, frozen=True):
     company: arc4.Address
     freelancer: arc4.Address
     reward: arc4.UInt64
 
-class DisputeData(arc4.Struct, frozen=False):
+class TaskState(arc4.Struct, frozen=False):
+    company: arc4.Address
+    freelancer: arc4.Address
+    reward: arc4.UInt64
     freelancer_votes: arc4.UInt64
     company_votes: arc4.UInt64
-    is_open: arc4.Bool
-    voters: arc4.DynamicArray[arc4.Address]
-    reward: arc4.UInt64
-    client_amount_transferred: arc4.Bool
-    freelancer_amount_transferred: arc4.Bool
+    voter_count: arc4.UInt64
+    remaining_claimants: arc4.UInt64
+    flags: arc4.UInt64
+
+@subroutine
+def vote_key(task_id: arc4.UInt64, voter: arc4.Address) -> Bytes:
+    return task_id.bytes + voter.bytes
+
+@subroutine
+def pay(receiver: Account, amount: UInt64) -> UInt64:
+    result = itxn.Payment(receiver=receiver, amount=amount, fee=0).submit()
+    return result.amount
 
 class TaskBountyContract(ARC4Contract):
     def __init__(self) -> None:
-        self.tasks = BoxMap(arc4.UInt64, TaskData, key_prefix="users")
-        self.disputes = BoxMap(arc4.UInt64, DisputeData, key_prefix="disputes")
+        # Task and dispute live in one box so dispute calls need a single box read
+        self.state = BoxMap(arc4.UInt64, TaskState, key_prefix="t")
+        self.voted = BoxMap(Bytes, arc4.Bool, key_prefix="voted")
 
     @arc4.abimethod
     def create_task(
@@ -28,187 +76,202 @@ class TaskBountyContract(ARC4Contract):
         freelancer: arc4.Address,
         reward: arc4.UInt64,
     ) -> None:
-        assert payment_txn.receiver == Global.current_application_address
-        assert payment_txn.amount >= reward.native
-        assert payment_txn.sender == company.native
-        self.tasks[task_id] = TaskData(company, freelancer, reward)
+        assert (
+            payment_txn.receiver == Global.current_application_address
+            and payment_txn.amount >= reward.native
+            and payment_txn.sender == company.native
+        ), "Invalid escrow payment"
+        assert task_id not in self.state, "Task already exists"
+        self.state[task_id] = TaskState(
+            company=company,
+            freelancer=freelancer,
+            reward=reward,
+            freelancer_votes=arc4.UInt64(0),
+            company_votes=arc4.UInt64(0),
+            voter_count=arc4.UInt64(0),
+            remaining_claimants=arc4.UInt64(0),
+            flags=arc4.UInt64(0),
+        )
 
     @arc4.abimethod
     def release_reward(self, task_id: arc4.UInt64, caller: arc4.Address) -> UInt64:
-        task = self.tasks[task_id]
-        assert caller == task.company, "Only company can release"
-        result = itxn.Payment(
-            sender=Global.current_application_address,
-            receiver=task.freelancer.native,
-            amount=task.reward.native,
-            fee=0,
-        ).submit()
-        del self.tasks[task_id]
-        return result.amount
+        task = self.state[task_id].copy()
+        assert caller == task.company, ERR_COMPANY_ONLY
+        assert task.flags.native == 0, ERR_DISPUTED
+        paid = pay(task.freelancer.native, task.reward.native)
+        del self.state[task_id]
+        return paid
 
     @arc4.abimethod
     def start_appeal(self, task_id: arc4.UInt64, caller: arc4.Address) -> None:
-        task = self.tasks[task_id]
-        assert caller == task.company or caller == task.freelancer
-        assert task_id not in self.disputes
-        self.disputes[task_id] = DisputeData(
-            freelancer_votes=arc4.UInt64(0),
-            company_votes=arc4.UInt64(0),
-            is_open=arc4.Bool(True),
-            voters=arc4.DynamicArray[arc4.Address](),
-            reward=task.reward,
-            client_amount_transferred=arc4.Bool(False),
-            freelancer_amount_transferred=arc4.Bool(False),
-        )
+        task = self.state[task_id].copy()
+        assert caller == task.company or caller == task.freelancer, ERR_NOT_PARTY
+        assert task.flags.native == 0, ERR_DISPUTED
+        self.state[task_id].flags = arc4.UInt64(DISPUTE_OPEN)
 
     @arc4.abimethod
     def cast_vote(
-        self, task_id: arc4.UInt64, vote_for_freelancer: arc4.Bool, caller: arc4.Address
+        self,
+        mbr_payment: gtxn.PaymentTransaction,
+        task_id: arc4.UInt64,
+        vote_for_freelancer: arc4.Bool,
+        caller: arc4.Address,
     ) -> None:
-        dispute = self.disputes[task_id].copy()
-        assert dispute.is_open
-        for voter in dispute.voters:
-            assert caller != voter, "Already voted"
+        # The voter funds their own voted box; claiming the reward refunds it
+        assert (
+            mbr_payment.receiver == Global.current_application_address
+            and mbr_payment.amount == VOTE_BOX_MBR
+            and mbr_payment.sender == caller.native
+        ), "Invalid vote MBR payment"
+        task = self.state[task_id].copy()
+        # Votes are only taken while the dispute is open and not settling
+        assert task.flags.native == DISPUTE_OPEN, "Voting closed"
+        assert task.voter_count.native < MAX_VOTERS, "Voter limit reached"
+        key = vote_key(task_id, caller)
+        assert key not in self.voted, "Already voted"
+        self.voted[key] = arc4.Bool(True)
+        # TaskState is fixed size, so write back only the fields that change
         if vote_for_freelancer:
-            dispute.freelancer_votes = arc4.UInt64(dispute.freelancer_votes.native + 1)
+            self.state[task_id].freelancer_votes = arc4.UInt64(task.freelancer_votes.native + 1)
         else:
-            dispute.company_votes = arc4.UInt64(dispute.company_votes.native + 1)
-        dispute.voters.append(caller)
-        self.disputes[task_id] = dispute
+            self.state[task_id].company_votes = arc4.UInt64(task.company_votes.native + 1)
+        self.state[task_id].voter_count = arc4.UInt64(task.voter_count.native + 1)
+        self.state[task_id].remaining_claimants = arc4.UInt64(task.remaining_claimants.native + 1)
 
     @arc4.abimethod
     def resolve_dispute(self, task_id: arc4.UInt64, caller: arc4.Address) -> UInt64:
-        task = self.tasks[task_id]
-        dispute = self.disputes[task_id].copy()
-        assert dispute.is_open
-        voter_reward_pool = arc4.UInt64(dispute.reward.native // 10) if dispute.voters.length > 0 else arc4.UInt64(0)
-        reward_to_winner = arc4.UInt64(dispute.reward.native - voter_reward_pool.native)
-        if dispute.freelancer_votes.native > dispute.company_votes.native:
-            result = itxn.Payment(
-                sender=Global.current_application_address,
-                receiver=task.freelancer.native,
-                amount=reward_to_winner.native,
-                fee=0,
-            ).submit()
-            dispute.freelancer_amount_transferred = arc4.Bool(True)
-            dispute.client_amount_transferred = arc4.Bool(True)
-        elif dispute.freelancer_votes.native < dispute.company_votes.native:
-            result = itxn.Payment(
-                sender=Global.current_application_address,
-                receiver=task.company.native,
-                amount=reward_to_winner.native,
-                fee=0,
-            ).submit()
-            dispute.client_amount_transferred = arc4.Bool(True)
-            dispute.freelancer_amount_transferred = arc4.Bool(True)
+        task = self.state[task_id].copy()
+        flags = task.flags.native
+        assert flags & DISPUTE_OPEN, ERR_NO_DISPUTE
+        reward = task.reward.native
+        freelancer_votes = task.freelancer_votes.native
+        company_votes = task.company_votes.native
+        voter_reward_pool = reward // VOTER_POOL_DIVISOR if task.voter_count.native > 0 else UInt64(0)
+        reward_to_winner = reward - voter_reward_pool
+        if freelancer_votes > company_votes:
+            assert (flags & BOTH_PAID) == 0, ERR_SETTLING
+            paid = pay(task.freelancer.native, reward_to_winner)
+            flags |= BOTH_PAID
+        elif freelancer_votes < company_votes:
+            assert (flags & BOTH_PAID) == 0, ERR_SETTLING
+            paid = pay(task.company.native, reward_to_winner)
+            flags |= BOTH_PAID
         else:
-            assert caller == task.company or caller == task.freelancer
-            reward_half = arc4.UInt64(reward_to_winner.native // 2)
             if caller == task.company:
-                dispute.client_amount_transferred = arc4.Bool(True)
-            elif caller == task.freelancer:
-                dispute.freelancer_amount_transferred = arc4.Bool(True)
-            result = itxn.Payment(
-                sender=Global.current_application_address,
-                receiver=caller.native,
-                amount=reward_half.native,
-                fee=0,
-            ).submit()
-        if dispute.freelancer_amount_transferred and dispute.client_amount_transferred:
-            del self.tasks[task_id]
-            dispute.is_open = arc4.Bool(False)
-        self.disputes[task_id] = dispute
-        return result.amount
+                paid_bit = UInt64(CLIENT_PAID)
+            else:
+                assert caller == task.freelancer, ERR_NOT_PARTY
+                paid_bit = UInt64(FREELANCER_PAID)
+            assert not (flags & paid_bit), "Half already paid"
+            flags |= paid_bit
+            paid = pay(caller.native, reward_to_winner // 2)
+        if (flags & BOTH_PAID) == BOTH_PAID:
+            if task.remaining_claimants.native == 0:
+                # No voting rewards left to claim, so the task box can go
+                del self.state[task_id]
+                return paid
+            # Keep the box around for voters to claim from
+            flags ^= DISPUTE_OPEN
+        self.state[task_id].flags = arc4.UInt64(flags)
+        return paid
 
     @arc4.abimethod
     def claim_voting_reward(self, task_id: arc4.UInt64, caller: arc4.Address) -> UInt64:
-        dispute = self.disputes[task_id].copy()
-        voters = dispute.voters
-        found = False
-        new_voters = arc4.DynamicArray[arc4.Address]()
+        task = self.state[task_id].copy()
+        # Shares are only final once voting has closed and both sides are paid
+        flags = task.flags.native
+        assert not (flags & DISPUTE_OPEN) and (flags & BOTH_PAID) == BOTH_PAID, ERR_NOT_SETTLED
+        key = vote_key(task_id, caller)
+        assert key in self.voted, "Caller did not vote"
+        # Claims need a settled dispute, so removing the entry cannot reopen voting
+        del self.voted[key]
+        total_reward = task.reward.native // VOTER_POOL_DIVISOR
+        share = total_reward // task.voter_count.native
+        # Pay the share plus a refund of the voter's voted-box MBR
+        paid = pay(caller.native, share + VOTE_BOX_MBR)
+        if task.remaining_claimants.native == 1:
+            del self.state[task_id]
+        else:
+            self.state[task_id].remaining_claimants = arc4.UInt64(task.remaining_claimants.native - 1)
+        return paid
+
+    @arc4.abimethod
+    def batch_claim_voting_rewards(
+        self, task_id: arc4.UInt64, voters: arc4.DynamicArray[arc4.Address]
+    ) -> UInt64:
+        # Each voter needs its voted box and its account available, plus the
+        # task box: 2 * len(voters) + 1 references. At 8 per transaction a
+        # full batch of 16 needs the app call plus four padding calls in the
+        # group, and the app call's fee must cover the 16 inner payments.
+        task = self.state[task_id].copy()
+        flags = task.flags.native
+        assert not (flags & DISPUTE_OPEN) and (flags & BOTH_PAID) == BOTH_PAID, ERR_NOT_SETTLED
+        batch_size = voters.length
+        assert batch_size > 0 and batch_size <= MAX_INNER_GROUP, "Invalid batch size"
+        total_reward = task.reward.native // VOTER_POOL_DIVISOR
+        # Each payment is the voter's share plus the refund of their voted-box MBR
+        amount = total_reward // task.voter_count.native + VOTE_BOX_MBR
+        # itxn.submit_txns only takes a fixed set of transactions, so build
+        # the variable-length payment group with the low-level ops
+        first = True
         for voter in voters:
-            if voter == caller:
-                found = True
+            key = vote_key(task_id, voter)
+            assert key in self.voted, "Voter did not vote"
+            del self.voted[key]
+            if first:
+                op.ITxnCreate.begin()
+                first = False
             else:
-                new_voters.append(voter)
-        assert found, "Caller did not vote"
-        total_reward = arc4.UInt64(dispute.reward.native // 10)
-        share = arc4.UInt64(total_reward.native // voters.length)
-        result = itxn.Payment(
-            sender=Global.current_application_address,
-            receiver=caller.native,
-            amount=share.native,
-            fee=0,
-        ).submit()
-        if new_voters.length == 0:
-            del self.disputes[task_id]
+                op.ITxnCreate.next()
+            op.ITxnCreate.set_type_enum(TransactionType.Payment)
+            op.ITxnCreate.set_receiver(voter.native)
+            op.ITxnCreate.set_amount(amount)
+            op.ITxnCreate.set_fee(0)
+        op.ITxnCreate.submit()
+        if task.remaining_claimants.native == batch_size:
+            del self.state[task_id]
         else:
-            dispute.voters = new_voters
-            self.disputes[task_id] = dispute
-        return result.amount
-
-  @arc4.abimethod
-def task_exists(self, task_id: arc4.UInt64) -> arc4.Bool:
-    return arc4.Bool(task_id in self.tasks)
- @arc4.abimethod
-def reject_task(self, task_id: arc4.UInt64, caller: arc4.Address) -> None:
-    task = self.tasks[task_id]
-    assert caller == task.freelancer, "Only freelancer can reject task"
-    refund_amount = task.reward.native
-    itxn.Payment(
-        sender=Global.current_application_address,
-        receiver=task.company.native,
-        amount=refund_amount,
-        fee=0,
-    ).submit()
-    del self.tasks[task_id]
-
-@arc4.abimethod
-def get_dispute_status(self, task_id: arc4.UInt64) -> DisputeData:
-    return self.disputes[task_id]
-
-@arc4.abimethod
-def get_task(self, task_id: arc4.UInt64) -> TaskData:
-    return self.tasks[task_id]
-
-@arc4.abimethod
-def cancel_task(self, task_id: arc4.UInt64, caller: arc4.Address) -> UInt64:
-    task = self.tasks[task_id]
-    assert caller == task.company, "Only company can cancel"
-    result = itxn.Payment(
-        sender=Global.current_application_address,
-        receiver=caller.native,
-        amount=task.reward.native,
-        fee=0,
-    ).submit()
-    del self.tasks[task_id]
-    return result.amount
+            self.state[task_id].remaining_claimants = arc4.UInt64(task.remaining_claimants.native - batch_size)
+        return amount * batch_size
 
-@arc4.abimethod
-def cast_vote_with_note(
-    self,
-    task_id: arc4.UInt64,
-    vote_for_freelancer: arc4.Bool,
-    note: arc4.String,
-    caller: arc4.Address
-) -> None:
-    # Same logic as cast_vote, but stores log(note)
-    log("VoteNote", note)
-
-@arc4.abimethod
-def update_freelancer(self, task_id: arc4.UInt64, new_freelancer: arc4.Address, caller: arc4.Address) -> None:
-    task = self.tasks[task_id]
-    assert caller == task.company, "Only company can update freelancer"
-    self.tasks[task_id] = TaskData(task.company, new_freelancer, task.reward)
+    @arc4.abimethod
+    def task_exists(self, task_id: arc4.UInt64) -> arc4.Bool:
+        # A settled task keeps its box until every voter has claimed, and its
+        # id stays taken until then, matching create_task
+        _length, exists = op.Box.length(self.state.key_prefix + task_id.bytes)
+        return arc4.Bool(exists)
 
-@arc4.abimethod
-def get_freelancer_tasks(self, freelancer: arc4.Address) -> arc4.DynamicArray[arc4.UInt64]:
-    result = arc4.DynamicArray[arc4.UInt64]()
-    for task_id, task_data in self.tasks.items():
-        if task_data.freelancer == freelancer:
-            result.append(task_id)
-    return result
+    @arc4.abimethod
+    def reject_task(self, task_id: arc4.UInt64, caller: arc4.Address) -> None:
+        task = self.state[task_id].copy()
+        assert caller == task.freelancer, "Only freelancer can reject task"
+        assert task.flags.native == 0, ERR_DISPUTED
+        pay(task.company.native, task.reward.native)
+        del self.state[task_id]
 
+    @arc4.abimethod
+    def get_dispute_status(self, task_id: arc4.UInt64) -> TaskState:
+        task = self.state[task_id].copy()
+        assert task.flags.native != 0, ERR_NO_DISPUTE
+        return task
 
+    @arc4.abimethod
+    def get_task(self, task_id: arc4.UInt64) -> TaskData:
+        task = self.state[task_id].copy()
+        return TaskData(task.company, task.freelancer, task.reward)
 
+    @arc4.abimethod
+    def cancel_task(self, task_id: arc4.UInt64, caller: arc4.Address) -> UInt64:
+        task = self.state[task_id].copy()
+        assert caller == task.company, ERR_COMPANY_ONLY
+        assert task.flags.native == 0, ERR_DISPUTED
+        paid = pay(caller.native, task.reward.native)
+        del self.state[task_id]
+        return paid
 
+    @arc4.abimethod
+    def update_freelancer(self, task_id: arc4.UInt64, new_freelancer: arc4.Address, caller: arc4.Address) -> None:
+        task = self.state[task_id].copy()
+        assert caller == task.company, ERR_COMPANY_ONLY
+        assert task.flags.native == 0, ERR_DISPUTED
+        self.state[task_id].freelancer = new_freelancer